@@ -0,0 +1,13 @@
+from setuptools import setup
+from mypyc.build import mypycify
+
+# compiles the markdown parser into a c extension, build it in place with
+#   pip install -r requirements-dev.txt
+#   python setup.py build_ext --inplace
+# and mdparser.*.so will be imported instead of src/mdparser.py
+setup(
+    name="tass-api-scraper",
+    package_dir={"": "src"},
+    py_modules=["mdparser"],
+    ext_modules=mypycify(["src/mdparser.py"]),
+)
@@ -2,14 +2,16 @@ import os
 import shutil
 import subprocess
 import logging
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-logging.basicConfig(level=logging.DEBUG)
+# set LOG_LEVEL=DEBUG for more output, INFO by default
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger("fetch_repos")
 
 # TODO make these args
 REPO_DIR = "repos"
 PATCHES_DIR = "patches"
+FETCH_WORKERS = 8
 
 TASS_GIT_URL = "https://github.com/TheAlphaSchoolSystemPTYLTD/"
 TASS_REPOS = [
@@ -33,45 +35,47 @@ TASS_REPOS = [
 ]
 
 
-@contextmanager
-def in_dir(dir: str):
-    curr = os.getcwd()
-    try:
-        os.chdir(dir)
-        yield
-    finally:
-        os.chdir(curr)
+def fetch_git_repo(repo: str):
+    path = os.path.join(REPO_DIR, repo)
+    url = TASS_GIT_URL+repo
+    # only the latest docs are parsed, the history isn't needed
+    res = subprocess.run(["git", "clone", "--depth=1", url, path])
+    res.check_returncode()
 
 
 def fetch_git_repos():
-    for repo in TASS_REPOS:
-        path = os.path.join(REPO_DIR, repo)
-        url = TASS_GIT_URL+repo
-        res = subprocess.run(["git", "clone", url, path])
-        res.check_returncode()
+    # clones are network bound so run them all at once
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+        futures = [ex.submit(fetch_git_repo, repo) for repo in TASS_REPOS]
+        for f in as_completed(futures):
+            f.result()
 
 
 def apply_patches(patch_dir: str, repo_dir: str):
     patches = sorted(os.listdir(patch_dir))
-    rel_patch_dir = os.path.relpath(patch_dir, repo_dir)
 
-    with in_dir(repo_dir):
-        for p in patches:
-            patch_path = os.path.join(rel_patch_dir, p)
-            res = subprocess.run(["git", "apply", patch_path])
-            res.check_returncode()
+    for p in patches:
+        patch_path = os.path.abspath(os.path.join(patch_dir, p))
+        res = subprocess.run(["git", "-C", repo_dir, "apply", patch_path])
+        res.check_returncode()
 
 
 def patch_repos():
-    for dir in os.listdir(PATCHES_DIR):
-        if dir not in TASS_REPOS:
-            logger.error(f"unknown patch dir: {dir}")
+    # no cwd changes while patching so each repo can be patched at once
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+        futures = []
+        for dir in os.listdir(PATCHES_DIR):
+            if dir not in TASS_REPOS:
+                logger.error(f"unknown patch dir: {dir}")
+
+            logger.info(f"patching {dir}")
+            patch_dir = os.path.join(PATCHES_DIR, dir)
+            repo_dir = os.path.join(REPO_DIR, dir)
 
-        logger.info(f"patching {dir}")
-        patch_dir = os.path.join(PATCHES_DIR, dir)
-        repo_dir = os.path.join(REPO_DIR, dir)
+            futures.append(ex.submit(apply_patches, patch_dir, repo_dir))
 
-        apply_patches(patch_dir, repo_dir)
+        for f in as_completed(futures):
+            f.result()
 
 
 def main():
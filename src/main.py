@@ -1,43 +1,125 @@
 import logging
 import os
-import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
 
-from mdparser import ParseError, parse_request
+import orjson
 
+from mdparser import ParseError, into_json, parse_request
 
-logging.basicConfig(level=logging.DEBUG)
+
+# set LOG_LEVEL=DEBUG to see parsing details, INFO by default
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 REPO_PATH = "repos"
 
 
+# yields each md file entry along with the scope of the dir it is in
+def iter_md_files(root: str) -> Iterator[tuple[str, os.DirEntry]]:
+    dirs = [root]
+
+    while dirs:
+        dirpath = dirs.pop()
+        scope = os.path.basename(dirpath)
+        subdirs = []
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    # skip versioned api calls, only concerned with v3
+                    # calls atm
+                    if "version" in entry.path:
+                        continue
+                    subdirs.append(entry.path)
+                    continue
+
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                if entry.name == "README.md":
+                    continue
+                if not entry.name.endswith(".md"):
+                    continue
+
+                yield scope, entry
+
+        # push in reverse so the first subdir is walked next, keeping the
+        # same top down order as os.walk
+        dirs.extend(reversed(subdirs))
+
+
+# reads the whole file with reads sized from fstat rather than going
+# through a buffered text file. os.read can come back short (or the file
+# can grow after the fstat) so keep reading until eof
+def read_text(path: str) -> str:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = max(os.fstat(fd).st_size, 1)
+        chunks = []
+        while chunk := os.read(fd, size):
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+
+    text = b"".join(chunks).decode("utf-8")
+    # match open()'s universal newlines, the parser splits on \n
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+# parses a single (scope, path) md file into its json, kept at the top
+# level so the process pool can pickle it. serialising in the worker means
+# only the json bytes get sent back instead of the whole Request. errors
+# are handed back rather than raised, raising would fail every other file
+# in the same map chunk
+def _parse_one(file: tuple[str, str]) -> bytes | Exception:
+    scope, path = file
+    filename = os.path.basename(path)
+
+    logger.info("parsing file: %s/%s", scope, filename)
+
+    try:
+        text = read_text(path)
+        logger.debug("file is %d chars: %.120s", len(text), text)
+
+        res = parse_request(text, scope)
+        logger.debug("%s", res)
+        return orjson.dumps(
+            res, default=into_json, option=orjson.OPT_INDENT_2
+        )
+    # orjson only serialises 255 levels deep, and each level of a response
+    # takes 3 ({"fields": {key: {"nested": ...}}}), so responses nested
+    # past ~84 levels raise JSONEncodeError here. ValueError also covers
+    # files that aren't valid utf-8 and orjson.JSONDecodeError
+    except (
+        ParseError, OSError, ValueError, orjson.JSONEncodeError
+    ) as err:
+        logger.exception("failed to parse %s/%s", scope, filename)
+        return err
+
+
 def main():
-    for dirpath, _, filenames in os.walk(REPO_PATH):
-        # skip versioned api calls, only concerned with v3 calls atm
-        if "version" in dirpath:
-            continue
-
-        for filename in filenames:
-            if filename == "README.md":
-                continue
-            if not filename.endswith(".md"):
-                continue
-
-            path = os.path.join(dirpath, filename)
-            with open(path) as file:
-                text = file.read()
-
-            scope = os.path.basename(dirpath)
-            logger.info(f"parsing file: {scope}: {text}")
-
-            try:
-                res = parse_request(text, scope)
-                logger.debug(f"{res}")
-                print(json.dumps(res.into_dict(), indent=2))
-                print()
-            except (ParseError, json.JSONDecodeError) as err:
-                logger.error(f"failed to parse {scope}/{filename}")
-                raise err
+    files = [(scope, entry.path) for scope, entry in iter_md_files(REPO_PATH)]
+
+    # the workers hand back utf-8 json so skip the text layer, writes are
+    # buffered and flushed once at the end
+    stdout = sys.stdout.buffer
+
+    # each file is parsed independently so spread them across all cores,
+    # map keeps the output in the same order as files
+    with ProcessPoolExecutor() as ex:
+        for out in ex.map(_parse_one, files, chunksize=16):
+            if isinstance(out, Exception):
+                # don't wait on the files that haven't been parsed yet
+                ex.shutdown(cancel_futures=True)
+                stdout.flush()
+                raise out
+
+            stdout.write(out)
+            stdout.write(b"\n\n")
+
+    stdout.flush()
 
 
 if __name__ == "__main__":
@@ -1,13 +1,45 @@
-from typing import Literal, Optional
+from collections import deque
+from typing import Callable, Iterator, Literal, Optional
 import logging
-import json
+import os
 import re
 
-logging.basicConfig(level=logging.DEBUG)
+import orjson
+
+# set LOG_LEVEL=DEBUG to see parsing details, INFO by default
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
-header_re = r"\* +\*\*"
-empty_line_re = r"\n\s*\n"
+_HEADER_RE = re.compile(r"\* +\*\*")
+# eg. **Required:**, **Optional**: or ***Conditional:***
+_PRESENCE_HEADER_RE = re.compile(
+    r"\*+\s*(required|optional|conditional)[\s*:]*",
+    re.IGNORECASE | re.ASCII,
+)
+
+_STRIP_NAME_TABLE = str.maketrans("", "", "*")
+
+_FENCE = "```"
+_JSON_FENCE_LANGS = ("javascript\n", "json\n")
+
+# maps tass doc types to python types
+_PARAM_TYPES = {
+    'integer or "all"': "any",
+    "boolean": "bool",
+    "date": "date",
+    "date dd/mm/yyyy": "date",
+    "timestamp yyyy-MM-dd HH:mm:ss.SSS": "datetime",  # datetime.datetime
+    "decimal": "float",
+    "number": "int",
+    "num": "int",
+    "integer": "int",
+    "array": "list",  # would be nice to include the type
+    "string": "str",
+    "time": "time",  # datetime.time
+}
+
+# maps a lower cased presence header to the presence it gives its params
+_PRESENCES = {p: p for p in ("required", "optional", "conditional")}
 
 
 class ParseError(Exception):
@@ -15,12 +47,15 @@ class ParseError(Exception):
 
 
 class Parameter:
+    __slots__ = ("name", "type", "doc", "presence")
+
     name: str
     type: str
     doc: str
-    presence: Literal["required", "optional", "conditional"]
+    # "required" | "optional" | "conditional", or "" until parsed
+    presence: str
 
-    def __init__(self):
+    def __init__(self) -> None:
         self.name = ""
         self.type = ""
         self.doc = ""
@@ -29,18 +64,12 @@ class Parameter:
     def __str__(self) -> str:
         return f"{self.presence}: {self.name} [{self.type}] - {self.doc}\n"
 
-    def into_dict(self) -> dict:
-        return {
-            "name": self.name,
-            "type": self.type,
-            "doc": self.doc,
-            "presence": self.presence,
-        }
-
 
 # a response field with type "array" that has no "nested" field is an
 # array of primitives
 class ResponseField:
+    __slots__ = ("key", "type", "nested")
+
     key: str
     type: Literal["data", "array", "object"]
     nested: Optional["Response"]
@@ -63,24 +92,13 @@ class ResponseField:
             f"type: {self.type}, " \
             f"has nested: {has_nested}"
 
-    def into_dict(self) -> dict:
-        d = {
-            "key": self.key,
-            "type": self.type,
-            "nested": None,
-        }
-
-        if self.nested is not None:
-            logger.debug(f"nested is not none: {self.nested}")
-            d["nested"] = self.nested.into_dict()
-
-        return d
-
 
 class Response:
+    __slots__ = ("fields",)
+
     fields: dict[str, ResponseField]
 
-    def __init__(self):
+    def __init__(self) -> None:
         self.fields = {}
 
     def str_indent(self, indent: int) -> str:
@@ -92,47 +110,54 @@ class Response:
                 s += f.nested.str_indent(indent+2)
         return s + "\n"
 
-    def __str__(self):
+    def __str__(self) -> str:
         return self.str_indent(0)
 
-    def into_dict(self) -> dict:
-        return {
-            "fields": {
-                k: f.into_dict() for k, f in self.fields.items()
-            }
-        }
 
+# merges src into dst in place, src's fields (and their nested responses)
+# are taken over by dst so src shouldn't be used afterwards
+def union_into(dst: Response, src: Response) -> None:
+    stack: list[tuple[Response, Response]] = [(dst, src)]
 
-def union_response(r1: Response, r2: Response) -> Response:
-    res = Response()
+    while stack:
+        d, s = stack.pop()
+        d_fields = d.fields
 
-    for k, v in r1.fields.items():
-        res.fields[k] = v
+        # a response unioned with itself is unchanged
+        if d is s:
+            continue
 
-    for k, v in r2.fields.items():
-        f = res.fields.get(k)
-        if f is None:
-            res.fields[k] = v
+        # nothing to merge, just take all the fields
+        if not d_fields:
+            d_fields.update(s.fields)
             continue
 
-        if f.type != v.type:
-            raise ValueError(
-                "field {} has conflicting types ({} and {})",
-                k, f.type, v.type
-            )
+        for k, v in s.fields.items():
+            f = d_fields.get(k)
+            if f is None:
+                d_fields[k] = v
+                continue
+            if f is v:
+                continue
 
-        # union the nested response if not primitive data
-        if f.type != "data":
-            if f.nested is None or v.nested is None:
-                if f.type == "array":
-                    continue
-                raise ValueError("ResponseField has missing nested type")
-            res.fields[k].nested = union_response(f.nested, v.nested)
+            if f.type != v.type:
+                raise conflicting_types_error(k, f.type, v.type)
 
-    return res
+            # union the nested response if not primitive data
+            if f.type != "data":
+                if f.nested is None or v.nested is None:
+                    if f.type == "array":
+                        continue
+                    raise ValueError("ResponseField has missing nested type")
+                stack.append((f.nested, v.nested))
 
 
 class Request:
+    __slots__ = (
+        "name", "doc", "scope", "version", "permissions", "params",
+        "sample_params", "success_response", "error_response",
+    )
+
     name: str
     doc: str
     scope: str
@@ -143,25 +168,6 @@ class Request:
     success_response: Response
     error_response: Response
 
-    def into_dict(self) -> dict:
-        req = {
-            "name": self.name,
-            "doc": self.doc,
-            "scope": self.scope,
-            "version": self.version,
-
-            "params": [p.into_dict() for p in self.params],
-            "sample_params": self.sample_params,
-            "success_response": self.success_response.into_dict(),
-            "error_response": self.error_response.into_dict(),
-        }
-
-        # permissions might not be set in v2 apis
-        if hasattr(self, "permissions"):
-            req["permissions"] = self.permissions,
-
-        return req
-
     def __str__(self) -> str:
         s = f"name: {self.name}\n" \
             f"doc: {self.doc}\n" \
@@ -178,9 +184,44 @@ class Request:
         return s
 
 
+# default hook for orjson.dumps, serialises the parsed objects as orjson
+# walks them instead of building a whole dict tree first
+def into_json(o: object) -> object:
+    if isinstance(o, ResponseField):
+        return {"key": o.key, "type": o.type, "nested": o.nested}
+    if isinstance(o, Response):
+        return {"fields": o.fields}
+    if isinstance(o, Parameter):
+        return {
+            "name": o.name,
+            "type": o.type,
+            "doc": o.doc,
+            "presence": o.presence,
+        }
+    if isinstance(o, Request):
+        req: dict[str, object] = {
+            "name": o.name,
+            "doc": o.doc,
+            "scope": o.scope,
+            "version": o.version,
+
+            "params": o.params,
+            "sample_params": o.sample_params,
+            "success_response": o.success_response,
+            "error_response": o.error_response,
+        }
+
+        # permissions might not be set in v2 apis
+        if hasattr(o, "permissions"):
+            req["permissions"] = o.permissions,
+
+        return req
+
+    raise TypeError(f"can't serialise {type(o).__name__}")
+
+
 def parse_request_name(s: str) -> str:
-    s = s.replace("*", "")
-    return s.strip()
+    return s.translate(_STRIP_NAME_TABLE).strip()
 
 
 def parse_version(s: str) -> int:
@@ -201,28 +242,10 @@ def parse_param_type(s: str) -> str:
         raise ParseError("expected type to be '[type]': '{}'", s)
 
     type_str = s[1:-1]
-    match type_str:
-        case 'integer or "all"':
-            return "any"
-        case "boolean":
-            return "bool"
-        case "date" | "date dd/mm/yyyy":
-            return "date"
-        case "timestamp yyyy-MM-dd HH:mm:ss.SSS":
-            return "datetime"  # datetime.datetime
-        case "decimal":
-            return "float"
-        case "number" | "num" | "integer":
-            return "int"
-        case "array":
-            return "list"  # would be nice to include the type
-        case "string":
-            return "str"
-        case "time":
-            return "time"  # datetime.time
-
-        case _:
-            raise ParseError("unknown type: {}", type_str)
+    try:
+        return _PARAM_TYPES[type_str]
+    except KeyError:
+        raise ParseError("unknown type: {}", type_str) from None
 
 
 def parse_param_line(s: str, presence: str) -> Parameter:
@@ -230,7 +253,7 @@ def parse_param_line(s: str, presence: str) -> Parameter:
 
     if presence == "conditional":
         param.doc = s
-        param.presence = "conditional"
+        param.presence = presence
         return param
 
     if presence != "required" and presence != "optional":
@@ -252,23 +275,43 @@ def parse_param_line(s: str, presence: str) -> Parameter:
     return param
 
 
-def parse_params(s: str) -> list[Parameter]:
-    spl = re.split(empty_line_re, s)
-    lines = [line.strip() for line in spl]
+# groups consecutive non blank lines into one param line, a linear scan
+# avoids backtracking on long runs of whitespace. lines are yielded as they
+# are found so the params can be parsed without building the list first
+def iter_param_lines(s: str) -> Iterator[str]:
+    # an empty section is still one (empty) line, like splitting it was
+    if not s:
+        yield s
+        return
+
+    # the inner lines keep their indentation, only the ends of the whole
+    # block are stripped
+    block: list[str] = []
+    for raw in s.split("\n"):
+        if raw.strip():
+            block.append(raw)
+        elif block:
+            yield "\n".join(block).strip()
+            block = []
+    if block:
+        yield "\n".join(block).strip()
 
-    params = []
-    presence = None
 
-    for line in lines:
-        logger.debug(line)
+def parse_params(s: str) -> list[Parameter]:
+    params: list[Parameter] = []
+    presence: Optional[str] = None
+
+    # checked once rather than per line
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for line in iter_param_lines(s):
+        if debug:
+            logger.debug("%s", line)
         if line.startswith("**"):
-            presence = line.replace("*", "").replace(":", "").lower()
-
-            match presence:
-                case "required" | "optional" | "conditional":
-                    continue
-                case _:
-                    raise ParseError("unknown presence {}", presence)
+            m = _PRESENCE_HEADER_RE.fullmatch(line)
+            presence = None if m is None else _PRESENCES.get(m[1].lower())
+            if presence is None:
+                raise ParseError("unknown presence {}", line)
+            continue
 
         if presence is None:
             raise ParseError("unknown presence for line {}", line)
@@ -281,70 +324,127 @@ def parse_params(s: str) -> list[Parameter]:
     return params
 
 
-def res_from_json_obj(o: dict) -> Response:
-    res = Response()
+def array_elem_type(a: list[object]) -> str:
+    if len(a) == 0:
+        raise ParseError("array has too many types: ")
 
-    for k, v in o.items():
-        if isinstance(v, dict):
-            f = ResponseField(k, "object", res_from_json_obj(v))
-            res.fields[k] = f
-            continue
-        if isinstance(v, list):
-            res.fields[k] = res_field_from_json_array(k, v)
-            continue
-
-        res.fields[k] = ResponseField(k, "data", None)
-
-    return res
+    t = type(a[0])
+    for e in a:
+        if type(e) is not t:
+            raise ParseError(
+                "array has too many types: {}",
+                ",".join((t.__name__, type(e).__name__))
+            )
 
+    return t.__name__
 
-def res_field_from_json_array(key: str, a: list) -> ResponseField:
-    f = ResponseField(key, "array", None)
 
-    types = {type(e).__name__ for e in a}
-    if len(types) != 1:
-        raise ParseError(
-            "array has too many types: {}", ",".join(types)
-        )
+def conflicting_types_error(k: str, t1: str, t2: str) -> ValueError:
+    return ValueError(
+        "field {} has conflicting types ({} and {})", k, t1, t2
+    )
 
-    t = list(types)[0]
-    if t == "str" or t == "int":
-        return f
 
-    if t != "dict":
-        raise ParseError("unsupported array type: {}", t)
+# walks the json breadth first with a queue instead of recursing so deeply
+# nested responses can't hit the recursion limit. the elements of an array
+# of objects are all walked straight into the array's nested response, so
+# they are unioned as they are found instead of each building a response
+# of their own. breadth first keeps the elements merging in the same order
+# they appear in
+def res_from_json_obj(o: dict[str, object]) -> Response:
+    res = Response()
+    queue: deque[tuple[Response, dict[str, object]]] = deque([(res, o)])
+
+    while queue:
+        curr, obj = queue.popleft()
+        fields = curr.fields
+        for k, v in obj.items():
+            f = fields.get(k)
+
+            if isinstance(v, dict):
+                if f is None:
+                    f = ResponseField(k, "object", Response())
+                    fields[k] = f
+                elif f.type != "object":
+                    raise conflicting_types_error(k, f.type, "object")
+                if f.nested is None:
+                    raise ValueError("ResponseField has missing nested type")
+                queue.append((f.nested, v))
+                continue
+
+            if isinstance(v, list):
+                t = array_elem_type(v)
+                if t != "str" and t != "int" and t != "dict":
+                    raise ParseError("unsupported array type: {}", t)
+
+                if f is None:
+                    nested = Response() if t == "dict" else None
+                    f = ResponseField(k, "array", nested)
+                    fields[k] = f
+                elif f.type != "array":
+                    raise conflicting_types_error(k, f.type, "array")
+
+                # an array of primitives found first wins over an array of
+                # objects and vice versa
+                if t != "dict" or f.nested is None:
+                    continue
+                for e in v:
+                    queue.append((f.nested, e))
+                continue
 
-    nested = Response()
-    for o in a:
-        nested = union_response(nested, res_from_json_obj(o))
+            if f is None:
+                fields[k] = ResponseField(k, "data", None)
+            elif f.type != "data":
+                raise conflicting_types_error(k, f.type, "data")
 
-    f.nested = nested
-    return f
+    return res
 
 
 def parse_json_response(s: str) -> Response:
     try:
-        decoded = json.loads(s)
+        decoded = orjson.loads(s)
         if isinstance(decoded, dict):
             return res_from_json_obj(decoded)
         else:
             raise ParseError(
                 "expected while json to be a dict, got: {}", type(decoded))
-    except (ParseError, ValueError, json.JSONDecodeError) as err:
+    except (ParseError, ValueError, orjson.JSONDecodeError) as err:
         logger.error(f"json is:\n{s}")
         raise ParseError("could not parse json response") from err
 
 
-def parse_success_response(s: str) -> Response:
-    _, match, rest = s.partition("```javascript\n")
-    if match == "":
-        _, match, rest = s.partition("```json\n")
-        if match == "":
-            raise ParseError("could not find start of js code block")
+# yields the body of each ```javascript or ```json code block, scanning
+# forward from the end of the last block so s is only walked once
+def iter_code_blocks(s: str) -> Iterator[str]:
+    pos = 0
+    while True:
+        fence = s.find(_FENCE, pos)
+        if fence < 0:
+            return
+
+        start = fence + len(_FENCE)
+        lang = next(
+            (ln for ln in _JSON_FENCE_LANGS if s.startswith(ln, start)), None
+        )
+        if lang is None:
+            # not a json block, but the fence may still be the tail of a
+            # longer run of backticks
+            pos = fence + 1
+            continue
+
+        start += len(lang)
+        end = s.find(_FENCE, start)
+        if end < 0:
+            raise ParseError("could not find end of js code block")
+
+        yield s[start:end]
+        pos = end + len(_FENCE)
 
-    json_str, match, _ = rest.partition("```")
-    if match == "":
-        raise ParseError("could not find end of js code block")
+
+def parse_success_response(s: str) -> Response:
+    json_str = next(iter_code_blocks(s), None)
+    if json_str is None:
+        raise ParseError("could not find start of js code block")
 
     try:
         return parse_json_response(json_str)
@@ -355,21 +455,10 @@ def parse_success_response(s: str) -> Response:
 def parse_error_response(s: str) -> Response:
     res = Response()
 
-    # tass have left out quotes for many of their err responses so add
-    # them back in
-    s = s.replace("__invalid:", '"__invalid":')
-    while True:
-        _, match, rest = s.partition("```javascript\n")
-        if match == "":
-            _, match, rest = s.partition("```json\n")
-            if match == "":
-                break
-
-        json_str, match, s = rest.partition("```")
-        if match == "":
-            raise ParseError("could not find end of js code block")
-
-        json_str = json_str.strip()
+    for block in iter_code_blocks(s):
+        # tass have left out quotes for many of their err responses so add
+        # them back in, only the code block is parsed so only fix that
+        json_str = block.replace("__invalid:", '"__invalid":').strip()
         if len(json_str) < 2:
             raise ParseError("stripped js code block empty: {}", json_str)
 
@@ -378,14 +467,59 @@ def parse_error_response(s: str) -> Response:
         if json_str[0] != "{":
             json_str = "{" + json_str + "}"
         try:
-            res = union_response(res, parse_json_response(json_str))
-        except ParseError as err:
+            union_into(res, parse_json_response(json_str))
+        # union_into raises ValueError when two blocks disagree on a type
+        except (ParseError, ValueError) as err:
             logger.error(f"failed error response is:\n{json_str}")
             raise ParseError("could not parse error response") from err
 
     return res
 
 
+def _skip_header(req: Request, body: str) -> None:
+    pass
+
+
+def _set_version(req: Request, body: str) -> None:
+    req.version = parse_version(body)
+
+
+def _set_permissions(req: Request, body: str) -> None:
+    req.permissions = body
+
+
+def _set_params(req: Request, body: str) -> None:
+    req.params = parse_params(body)
+
+
+def _set_success_response(req: Request, body: str) -> None:
+    req.success_response = parse_success_response(body)
+
+
+def _set_error_response(req: Request, body: str) -> None:
+    req.error_response = parse_error_response(body)
+
+
+def _set_sample_params(req: Request, body: str) -> None:
+    req.sample_params = body
+
+
+# lower cased header -> function that parses the header's body into req
+_HEADER_HANDLERS: dict[str, Callable[[Request, str], None]] = {
+    "version history": _skip_header,
+    "version": _set_version,
+    "permission": _set_permissions,
+    "method": _skip_header,
+    "params": _set_params,
+    "parameters": _set_params,
+    "success response": _set_success_response,
+    "error response": _set_error_response,
+    "sample parameters": _set_sample_params,
+    "sample get": _skip_header,
+    "sample post": _skip_header,
+}
+
+
 def parse_request(text: str, api_scope: str) -> Request:
     req = Request()
     req.scope = api_scope
@@ -397,50 +531,24 @@ def parse_request(text: str, api_scope: str) -> Request:
     req.name = parse_request_name(title)
 
     logger.debug("parsing req doc")
-    split = re.split(header_re, text)
+    split = _HEADER_RE.split(text)
     desc = split[0].strip()
     if "**:" in desc:
         raise ParseError("seems as if req has no documentation")
     req.doc = desc
 
+    debug = logger.isEnabledFor(logging.DEBUG)
     for spl in split[1:]:
         header, match, body = spl.partition(":**")
         if match == "":
             raise ParseError("text is malformed at header split: {}", spl)
 
-        logger.debug(f"header is '{header}'")
-        match header.lower():
-            case "version history":
-                logger.debug("parsing version history")
-                pass
-            case "version":
-                logger.debug("parsing version")
-                req.version = parse_version(body.strip())
-            case "permission":
-                logger.debug("parsing permission")
-                req.permissions = body.strip()
-            case "method":
-                logger.debug("parsing method")
-                pass
-            case "params" | "parameters":
-                logger.debug("parsing params")
-                req.params = parse_params(body.strip())
-            case "success response":
-                logger.debug("parsing success response")
-                req.success_response = parse_success_response(body.strip())
-            case "error response":
-                logger.debug("parsing error response")
-                req.error_response = parse_error_response(body.strip())
-            case "sample parameters":
-                logger.debug("parsing sample params")
-                req.sample_params = body.strip()
-            case "sample get":
-                logger.debug("parsing sample get")
-                pass
-            case "sample post":
-                logger.debug("parsing sample post")
-                pass
-            case _:
-                raise ParseError("unknown header: {}", header)
+        handler = _HEADER_HANDLERS.get(header.strip().lower())
+        if handler is None:
+            raise ParseError("unknown header: {}", header)
+
+        if debug:
+            logger.debug("parsing header '%s'", header)
+        handler(req, body.strip())
 
     return req